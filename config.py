@@ -13,17 +13,25 @@ class Config:
     HOST = "0.0.0.0"
     PORT = 8090
 
-    DEBUG = True
+    # 调试模式默认关闭（开发时设置 SHARP_DEBUG=1）
+    DEBUG = os.environ.get("SHARP_DEBUG", "0") == "1"
     
     # 文件上传配置
     MAX_VIDEO_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB
-    ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
-    UPLOAD_VIDEO_CHUNK_SIZE = 8192
+    ALLOWED_VIDEO_EXTENSIONS = frozenset({'mp4', 'avi', 'mov', 'mkv'})
+    UPLOAD_VIDEO_CHUNK_SIZE = 1024 * 1024
     
     MAX_IMAGE__CONTENT_LENGTH = 30 * 1024 * 1024  # 500MB
-    ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'jfif'}
+    ALLOWED_IMAGE_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'jfif'})
     
     Target_File = "train.ply"
+
+    # ==================== 模型文件下发配置 ====================
+    # 由前端服务器零拷贝发送模型文件，Flask只返回头部
+    # Apache/lighttpd: 开启 X-Sendfile
+    USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE", "0") == "1"
+    # nginx: internal location 前缀（指向DATA_DIR），如 "/protected/"；为空则不使用
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX", "")
     
     # ==================== Conda 环境基础配置 ====================
     # Conda根路径（可通过 `conda info --base` 命令获取）
@@ -35,6 +43,18 @@ class Config:
     GAUSSIAN_REPO_PATH = Path("/home/fzg25/project/ml-sharp")
     #虚拟环境名
     GAUSSIAN_ENV = "sharp"
+    # 复用常驻 sharp 进程（只导入一次 sharp/torch），设置 SHARP_PERSISTENT_WORKER=1 开启
+    SHARP_PERSISTENT_WORKER = os.environ.get("SHARP_PERSISTENT_WORKER", "0") == "1"
+    # 单个重建任务的最长运行时间（秒），超时杀掉（常驻 worker 随后重新拉起）；0 表示不限制
+    SHARP_JOB_TIMEOUT = int(os.environ.get("SHARP_JOB_TIMEOUT", "3600")) or None
+    # 整个服务同时运行的重建任务上限（所有 Web worker 合计）
+    SHARP_MAX_WORKERS = int(os.environ.get("SHARP_MAX_WORKERS", "0")) or max(1, (os.cpu_count() or 2) // 2)
+    # Web worker 进程数；gunicorn 也用 WEB_CONCURRENCY 作为 -w 的默认值，启动时只设它即可
+    WEB_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+    # 每个 Web worker 各自持有一个进程池，按 worker 数平分上限
+    SHARP_POOL_WORKERS = max(1, SHARP_MAX_WORKERS // WEB_WORKERS)
+    # 任务状态持久化（SQLite）；不放在 DATA_DIR 下，以免与同名用户目录冲突
+    TASK_DB_PATH = BASE_DIR / "db" / "tasks.db"
     
 
     
@@ -20,7 +20,6 @@ Notes
 from __future__ import annotations
 
 import argparse
-import struct
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Sequence, Tuple
@@ -38,104 +37,119 @@ class PlyHeader:
     data_start_offset: int
 
 
-_PLY_TYPE_TO_STRUCT = {
-    "char": "b",
-    "int8": "b",
-    "uchar": "B",
-    "uint8": "B",
-    "short": "h",
-    "int16": "h",
-    "ushort": "H",
-    "uint16": "H",
-    "int": "i",
-    "int32": "i",
-    "uint": "I",
-    "uint32": "I",
-    "float": "f",
-    "float32": "f",
-    "double": "d",
-    "float64": "d",
+_PLY_TYPE_TO_NUMPY = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "i2",
+    "int16": "i2",
+    "ushort": "u2",
+    "uint16": "u2",
+    "int": "i4",
+    "int32": "i4",
+    "uint": "u4",
+    "uint32": "u4",
+    "float": "f4",
+    "float32": "f4",
+    "double": "f8",
+    "float64": "f8",
 }
 
 
-def _readline_ascii(f) -> bytes:
-    line = f.readline()
-    if not line:
-        raise EOFError("Unexpected EOF while reading PLY header")
-    return line
+_HEADER_CHUNK_SIZE = 65536
 
 
-def parse_ply_header(path: Path) -> PlyHeader:
-    with path.open("rb") as f:
-        header_lines: List[str] = []
-
-        first = _readline_ascii(f)
-        first_s = first.decode("ascii", errors="strict").rstrip("\r\n")
-        header_lines.append(first_s)
-        if first_s.strip() != "ply":
+def _read_header_blob(f, path: Path) -> bytes:
+    """Read from the start of `f` up to and including the `end_header` line."""
+    head = b""
+    search_from = 0
+    while True:
+        chunk = f.read(_HEADER_CHUNK_SIZE)
+        if not chunk:
+            raise EOFError("Unexpected EOF while reading PLY header")
+        if not head and not chunk.startswith(b"ply"):
             raise ValueError(f"Not a PLY file: {path}")
-
-        fmt_line = _readline_ascii(f)
-        fmt_s = fmt_line.decode("ascii", errors="strict").rstrip("\r\n")
-        header_lines.append(fmt_s)
-        fmt_parts = fmt_s.strip().split()
-        if len(fmt_parts) != 3 or fmt_parts[0] != "format":
-            raise ValueError(f"Invalid format line in header: {fmt_s}")
-        fmt, version = fmt_parts[1], fmt_parts[2]
-
-        vertex_count = None
-        vertex_properties: List[Tuple[str, str]] = []
-        in_vertex = False
-
+        head += chunk
         while True:
-            bline = _readline_ascii(f)
-            line = bline.decode("ascii", errors="strict").rstrip("\r\n")
-            header_lines.append(line)
-
-            stripped = line.strip()
-            if stripped == "end_header":
-                data_start = f.tell()
+            idx = head.find(b"end_header", search_from)
+            if idx < 0:
+                # keep a tail so a marker split across chunks is still found
+                search_from = max(0, len(head) - len(b"end_header"))
+                break
+            eol = head.find(b"\n", idx)
+            if eol < 0:
+                search_from = idx
                 break
+            line_start = head.rfind(b"\n", 0, idx) + 1
+            if head[line_start:eol].strip() == b"end_header":
+                return head[: eol + 1]
+            search_from = idx + 1
 
-            parts = stripped.split()
-            if not parts:
-                continue
-
-            if parts[0] == "element":
-                if len(parts) != 3:
-                    raise ValueError(f"Invalid element line: {line}")
-                elem_name = parts[1]
-                elem_count = int(parts[2])
-                in_vertex = elem_name == "vertex"
-                if in_vertex:
-                    vertex_count = elem_count
-                continue
-
-            if parts[0] == "property":
-                if in_vertex:
-                    if len(parts) == 3:
-                        p_type, p_name = parts[1], parts[2]
-                    elif len(parts) >= 5 and parts[1] == "list":
-                        raise ValueError(
-                            "List properties are not supported for vertex in this converter. "
-                            f"Found: {line}"
-                        )
-                    else:
-                        raise ValueError(f"Invalid property line: {line}")
-                    vertex_properties.append((p_type, p_name))
-                continue
-
-        if vertex_count is None:
-            raise ValueError(f"No vertex element found in header: {path}")
-
-        return PlyHeader(
-            format=fmt,
-            version=version,
-            vertex_count=vertex_count,
-            vertex_properties=vertex_properties,
-            header_lines=header_lines,
-            data_start_offset=data_start,
-        )
+
+def parse_ply_header(path: Path) -> PlyHeader:
+    with path.open("rb") as f:
+        header_blob = _read_header_blob(f, path)
+
+    data_start = len(header_blob)
+    header_lines: List[str] = header_blob.decode("ascii", errors="strict").splitlines()
+    if len(header_lines) < 2 or header_lines[0].strip() != "ply":
+        raise ValueError(f"Not a PLY file: {path}")
+
+    fmt_s = header_lines[1]
+    fmt_parts = fmt_s.strip().split()
+    if len(fmt_parts) != 3 or fmt_parts[0] != "format":
+        raise ValueError(f"Invalid format line in header: {fmt_s}")
+    fmt, version = fmt_parts[1], fmt_parts[2]
+
+    vertex_count = None
+    vertex_properties: List[Tuple[str, str]] = []
+    in_vertex = False
+
+    for line in header_lines[2:]:
+        stripped = line.strip()
+        if stripped == "end_header":
+            break
+
+        parts = stripped.split()
+        if not parts:
+            continue
+
+        if parts[0] == "element":
+            if len(parts) != 3:
+                raise ValueError(f"Invalid element line: {line}")
+            elem_name = parts[1]
+            elem_count = int(parts[2])
+            in_vertex = elem_name == "vertex"
+            if in_vertex:
+                vertex_count = elem_count
+            continue
+
+        if parts[0] == "property":
+            if in_vertex:
+                if len(parts) == 3:
+                    p_type, p_name = parts[1], parts[2]
+                elif len(parts) >= 5 and parts[1] == "list":
+                    raise ValueError(
+                        "List properties are not supported for vertex in this converter. "
+                        f"Found: {line}"
+                    )
+                else:
+                    raise ValueError(f"Invalid property line: {line}")
+                vertex_properties.append((p_type, p_name))
+            continue
+
+    if vertex_count is None:
+        raise ValueError(f"No vertex element found in header: {path}")
+
+    return PlyHeader(
+        format=fmt,
+        version=version,
+        vertex_count=vertex_count,
+        vertex_properties=vertex_properties,
+        header_lines=header_lines,
+        data_start_offset=data_start,
+    )
 
 
 def _endian_for_format(fmt: str) -> str:
@@ -146,12 +160,19 @@ def _endian_for_format(fmt: str) -> str:
     raise ValueError(f"Unsupported PLY format for binary parsing: {fmt}")
 
 
-def _struct_for_vertex(props: Sequence[Tuple[str, str]], endian: str) -> struct.Struct:
-    try:
-        fmt = endian + "".join(_PLY_TYPE_TO_STRUCT[t] for t, _ in props)
-    except KeyError as e:
-        raise ValueError(f"Unsupported PLY scalar type: {e}") from e
-    return struct.Struct(fmt)
+_DTYPE_CACHE: dict[tuple, np.dtype] = {}
+
+
+def _numpy_dtype_for_vertex(props: Sequence[Tuple[str, str]], endian: str) -> np.dtype:
+    key = (endian, tuple(props))
+    dtype = _DTYPE_CACHE.get(key)
+    if dtype is None:
+        try:
+            dtype = np.dtype([(name, endian + _PLY_TYPE_TO_NUMPY[t]) for t, name in props])
+        except KeyError as e:
+            raise ValueError(f"Unsupported PLY scalar type: {e}") from e
+        _DTYPE_CACHE[key] = dtype
+    return dtype
 
 
 def read_vertex_table_binary(path: Path, header: PlyHeader) -> dict[str, np.ndarray]:
@@ -159,33 +180,23 @@ def read_vertex_table_binary(path: Path, header: PlyHeader) -> dict[str, np.ndar
         raise ValueError(f"Only binary PLY is supported. Got: {header.format}")
 
     endian = _endian_for_format(header.format)
-    st = _struct_for_vertex(header.vertex_properties, endian)
-
-    arrays: dict[str, np.ndarray] = {}
-    for _ptype, pname in header.vertex_properties:
-        arrays[pname] = np.empty((header.vertex_count,), dtype=np.float32)
+    dtype = _numpy_dtype_for_vertex(header.vertex_properties, endian)
 
+    # Read the whole vertex block in one call instead of unpacking row by row
     with path.open("rb") as f:
         f.seek(header.data_start_offset)
-        for i in range(header.vertex_count):
-            chunk = f.read(st.size)
-            if len(chunk) != st.size:
-                raise EOFError(
-                    f"Unexpected EOF while reading vertex data at {i}/{header.vertex_count}"
-                )
-            values = st.unpack(chunk)
-            for (_ptype, pname), v in zip(header.vertex_properties, values):
-                arrays[pname][i] = float(v)
+        raw = np.fromfile(f, dtype=dtype, count=header.vertex_count)
 
-    return arrays
+    if raw.shape[0] != header.vertex_count:
+        raise EOFError(
+            f"Unexpected EOF while reading vertex data at {raw.shape[0]}/{header.vertex_count}"
+        )
 
+    # Zero-copy field views in the file's native dtype; callers cast only what they use
+    return {name: raw[name] for _ptype, name in header.vertex_properties}
 
-def write_ply_binary_vertex_only(
-    path: Path,
-    vertex_count: int,
-    schema: Sequence[Tuple[str, str]],
-    columns: dict[str, np.ndarray],
-) -> None:
+
+def _vertex_only_header(vertex_count: int, schema: Sequence[Tuple[str, str]]) -> str:
     header_lines: List[str] = [
         "ply",
         "format binary_little_endian 1.0",
@@ -194,9 +205,18 @@ def write_ply_binary_vertex_only(
     for p_type, p_name in schema:
         header_lines.append(f"property {p_type} {p_name}")
     header_lines.append("end_header")
-    header = "\n".join(header_lines) + "\n"
+    return "\n".join(header_lines) + "\n"
 
-    st = _struct_for_vertex(schema, "<")
+
+def write_ply_binary_vertex_only(
+    path: Path,
+    vertex_count: int,
+    schema: Sequence[Tuple[str, str]],
+    columns: dict[str, np.ndarray],
+) -> None:
+    header = _vertex_only_header(vertex_count, schema)
+
+    out_dtype = _numpy_dtype_for_vertex(schema, "<")
 
     for _t, name in schema:
         if name not in columns:
@@ -206,11 +226,37 @@ def write_ply_binary_vertex_only(
                 f"Column {name} has {columns[name].shape[0]} rows, expected {vertex_count}"
             )
 
+    arr = np.empty((vertex_count,), dtype=out_dtype)
+    for _t, name in schema:
+        arr[name] = columns[name].astype(out_dtype[name], copy=False)
+
     with path.open("wb") as f:
         f.write(header.encode("ascii"))
-        for i in range(vertex_count):
-            row = [columns[name][i] for _t, name in schema]
-            f.write(st.pack(*row))
+        arr.tofile(f)
+
+
+def write_ply_binary_vertex_table(
+    path: Path,
+    schema: Sequence[Tuple[str, str]],
+    data: np.ndarray,
+) -> None:
+    """Write an (N, P) float32 row-major table as a vertex-only PLY.
+
+    Every schema property must be `float`/`float32`; the table is then
+    byte-identical to the PLY vertex block and is written without repacking.
+    """
+    if data.ndim != 2 or data.shape[1] != len(schema):
+        raise ValueError(f"Table shape {data.shape} does not match {len(schema)} properties")
+    for p_type, p_name in schema:
+        if _PLY_TYPE_TO_NUMPY.get(p_type) != "f4":
+            raise ValueError(f"Table write requires float32 properties, got {p_type} {p_name}")
+
+    sdtype = _numpy_dtype_for_vertex(schema, "<")
+    table = np.ascontiguousarray(data, dtype="<f4")
+
+    with path.open("wb") as f:
+        f.write(_vertex_only_header(data.shape[0], schema).encode("ascii"))
+        table.view(sdtype).reshape(data.shape[0]).tofile(f)
 
 
 def target_schema_scheme_b() -> List[Tuple[str, str]]:
@@ -244,19 +290,16 @@ def convert(teaser_path: Path, output_path: Path) -> None:
     schema = target_schema_scheme_b()
     n = teaser_header.vertex_count
 
-    out_cols: dict[str, np.ndarray] = {}
-    for _t, name in schema:
-        if name in teaser_cols:
-            out_cols[name] = teaser_cols[name].astype(np.float32, copy=False)
-        else:
-            out_cols[name] = np.zeros((n,), dtype=np.float32)
-
     # normals forced to 0 per scheme-B
-    out_cols["nx"].fill(0.0)
-    out_cols["ny"].fill(0.0)
-    out_cols["nz"].fill(0.0)
+    forced_zero = ("nx", "ny", "nz")
+
+    # SoA in, row-major table out: missing columns simply stay zero
+    data = np.zeros((n, len(schema)), dtype=np.float32)
+    for i, (_t, name) in enumerate(schema):
+        if name in teaser_cols and name not in forced_zero:
+            data[:, i] = teaser_cols[name]
 
-    write_ply_binary_vertex_only(output_path, n, schema, out_cols)
+    write_ply_binary_vertex_table(output_path, schema, data)
 
 
 def _summarize_header(path: Path) -> str:
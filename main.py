@@ -5,6 +5,7 @@ import os
 import logging
 from config import Config
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 # 配置MIME类型
 mimetypes.add_type('application/wasm', '.wasm')
@@ -40,6 +41,14 @@ def create_app():
     app.config['TEMPLATES_DIR'] = Config.TEMPLATE_DIR
     app.config['DATA_DIR'] = Config.DATA_DIR
     app.config['LOG_DIR'] = Config.LOG_DIR
+    app.config['X_ACCEL_REDIRECT_PREFIX'] = Config.X_ACCEL_REDIRECT_PREFIX
+    app.use_x_sendfile = Config.USE_X_SENDFILE
+
+    # 共享的存储管理器（避免每个请求重复构造/解析索引）
+    from utils.storage import StorageManager
+    app.extensions['storage'] = StorageManager(Config.DATA_DIR)
+    # 重建任务进程池（限制并发的CPU/GPU密集任务，且不与请求线程争用GIL）
+    app.extensions['sharp_pool'] = ProcessPoolExecutor(max_workers=Config.SHARP_POOL_WORKERS)
     
     
     # 启用CORS
@@ -55,6 +64,12 @@ def create_app():
     app.register_blueprint(login_bp)
     app.register_blueprint(sharp_bp)
     app.register_blueprint(manager_bp)
+
+    # 上次运行时未结束的任务不会再被执行，标记为失败（前端据此停止等待）
+    from routes.sharp import task_store
+    orphaned = task_store.fail_orphaned("重建失败: 服务器已重启，请重新上传")
+    if orphaned:
+        logger.info(f"已将 {orphaned} 个未完成任务标记为失败")
     
     return app
 
@@ -1,15 +1,32 @@
 from flask import Blueprint, render_template, jsonify, request, session, current_app, send_from_directory
 import os
 import shutil
+import threading
+import uuid
 from datetime import datetime
 from werkzeug.utils import secure_filename
 from . import login_required
-from utils.storage import StorageManager
 
 # 创建蓝图
 manager_bp = Blueprint('manager', __name__)
 
 
+def _remove_tree_async(path, trash_prefix):
+    """先同步改名（立即释放原目录名，出错可直接返回），再在后台线程删除。
+    删除中途进程退出留下的目录由 StorageManager.ensure_user 清理"""
+    trash = os.path.join(os.path.dirname(path), f"{trash_prefix}{uuid.uuid4().hex}")
+    os.rename(path, trash)
+    logger = current_app.logger
+
+    def _rm():
+        try:
+            shutil.rmtree(trash)
+        except Exception:
+            logger.exception('后台删除目录失败: %s', trash)
+
+    threading.Thread(target=_rm, daemon=True).start()
+
+
 @manager_bp.route('/manager')
 @login_required
 def manager_page():
@@ -27,7 +44,7 @@ def delete_model(model_name):
     model_path = os.path.abspath(os.path.join(data_dir, user_name, model_name))
     user_dir = os.path.abspath(os.path.join(data_dir, user_name))
 
-    sm = StorageManager(data_dir)
+    sm = current_app.extensions['storage']
 
     # 防止路径穿越
     if not model_path.startswith(user_dir + os.sep) and os.path.basename(model_path) != model_name:
@@ -38,22 +55,19 @@ def delete_model(model_name):
         folder = os.path.dirname(model_path)
         try:
             if os.path.isdir(folder):
-                # remove the entire folder containing this file
-                shutil.rmtree(folder)
+                # move the folder away first: if that fails the index is untouched
+                _remove_tree_async(folder, sm.TRASH_PREFIX)
                 # remove any indexed models under this folder
                 try:
-                    models = sm.list_models(user_name)
                     prefix = os.path.relpath(folder, user_dir).replace('\\', '/')
                     if not prefix.endswith('/'):
                         prefix = prefix + '/'
-                    for m in models:
-                        if m['relpath'].startswith(prefix):
-                            sm.remove_model(user_name, m['relpath'])
+                    sm.remove_models_under(user_name, prefix)
                 except Exception:
                     current_app.logger.exception('从索引移除模型失败')
                 return jsonify({"status": "success", "message": "模型所在文件夹已删除"})
             else:
-                # containing folder does not exist (file likely missing) — ensure xml record removed
+                # containing folder does not exist (file likely missing) — ensure index record removed
                 try:
                     sm.remove_model(user_name, model_name)
                 except Exception:
@@ -64,14 +78,10 @@ def delete_model(model_name):
             return jsonify({"status": "error", "message": str(e)}), 500
     elif os.path.isdir(model_path):
         try:
-            shutil.rmtree(model_path)
+            _remove_tree_async(model_path, sm.TRASH_PREFIX)
             # remove any indexed models under this folder
             try:
-                models = sm.list_models(user_name)
-                prefix = model_name.rstrip('/') + '/'
-                for m in models:
-                    if m['relpath'].startswith(prefix):
-                        sm.remove_model(user_name, m['relpath'])
+                sm.remove_models_under(user_name, model_name.rstrip('/') + '/')
             except Exception:
                 current_app.logger.exception('从索引移除模型失败')
             return jsonify({"status": "success", "message": "模型删除成功"})
@@ -94,8 +104,7 @@ def rename_model():
     if not old_name or not new_name:
         return jsonify({"status": "error", "message": "参数缺失"}), 400
 
-    data_dir = current_app.config.get('DATA_DIR', 'data')
-    sm = StorageManager(data_dir)
+    sm = current_app.extensions['storage']
     try:
         # old_name is relpath; new_name is base name without extension
         new_rel = sm.rename_model(user_name, old_name, new_name)
@@ -1,9 +1,14 @@
-from flask import Blueprint, render_template, jsonify, request, session, current_app, send_from_directory
+from flask import Blueprint, render_template, jsonify, request, session, current_app, send_from_directory, Response
 import os
 import uuid
-import threading
+import logging
+import gzip
+import json
 import time
 import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from werkzeug.utils import secure_filename
 from . import login_required
@@ -12,12 +17,27 @@ from trainer_image import ImageModelTrainer
 from convert import convert as ply_convert
 from pathlib import Path
 from utils.storage import StorageManager
+from utils.task_store import TaskStore
 
 # 创建蓝图
 sharp_bp = Blueprint('sharp', __name__)
 
-# 存储任务状态的全局字典
-sharp_tasks = {}
+logger = logging.getLogger(__name__)
+
+# 任务状态存储（SQLite，进程池中的worker与Flask进程共享）
+task_store = TaskStore(Config.TASK_DB_PATH)
+
+# SSE 连接最长保持时间（秒），到时断开，前端退回轮询。
+# 注意：每个打开的状态页在这段时间内独占一个服务器线程（gthread --threads 8 时，
+# 8 个标签页即可占满一个 worker），线程数需按同时查看进度的用户数留出余量
+SSE_MAX_LIFETIME = 600
+# 服务端检查任务状态的间隔（秒）；每次检查打开一次 SQLite 连接
+SSE_POLL_INTERVAL = 2.5
+# 未结束的任务超过该时间（秒）没有状态更新时不再推送
+SSE_STALE_AFTER = 300
+
+# 进程池损坏（worker 被 OOM kill / 崩溃）后重建时加锁，避免并发请求各建一个
+_pool_lock = threading.Lock()
 
 class TaskStatus:
     """任务状态跟踪"""
@@ -30,31 +50,15 @@ class TaskStatus:
 
 def update_task_status(task_id, status, message="", progress=0, result=None):
     """更新任务状态"""
-    if task_id not in sharp_tasks:
-        sharp_tasks[task_id] = {
-            "status": status,
-            "message": message,
-            "progress": progress,
-            "result": result,
-            "created_at": time.time(),
-            "updated_at": time.time()
-        }
-    else:
-        sharp_tasks[task_id].update({
-            "status": status,
-            "message": message,
-            "progress": progress,
-            "result": result,
-            "updated_at": time.time()
-        })
+    task_store.update(task_id, status, message, progress, result)
 
 # 允许的扩展名
 
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_IMAGE_EXTENSIONS
+    ext = os.path.splitext(filename)[1][1:].lower()
+    return bool(ext) and ext in Config.ALLOWED_IMAGE_EXTENSIONS
 
 def generate_unique_filename(original_filename, username):
     """生成唯一的文件名"""
@@ -95,6 +99,7 @@ def upload_image():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'message': '不支持的文件类型'}), 400
 
+    task_id = None
     try:
         
         # create task
@@ -104,22 +109,49 @@ def upload_image():
         
         # save uploaded image into its own folder (username/<image_folder>/image.jpg)
         data_dir = current_app.config.get('DATA_DIR', 'data')
-        sm = StorageManager(data_dir)
+        sm = current_app.extensions['storage']
         rel_folder, filename_saved, save_path = sm.save_image(username, file)
         update_task_status(task_id, TaskStatus.UPLOADED, "文件已上传", 10)
        
 
 
-        # start background processing thread
-        t = threading.Thread(target=_run_sharp_task, args=(task_id, data_dir, save_path, username, rel_folder), daemon=True)
-        t.start()
+        # submit background processing to the process pool
+        fut = _submit_to_pool(current_app._get_current_object(),
+                              _run_sharp_task, task_id, data_dir, save_path, username, rel_folder)
+        fut.add_done_callback(lambda f: _on_sharp_task_done(task_id, f))
 
         return jsonify({'success': True, 'task_id': task_id})
     except Exception as e:
         current_app.logger.exception('上传图像失败')
+        if task_id is not None:
+            update_task_status(task_id, TaskStatus.FAILED, f"提交任务失败: {e}", 0)
         return jsonify({'success': False, 'message': '服务器错误: ' + str(e)}), 500
 
 
+def _submit_to_pool(app, fn, *args):
+    """提交到重建进程池；池已损坏（worker 异常退出）时重建后再提交一次"""
+    pool = app.extensions['sharp_pool']
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        with _pool_lock:
+            # 其他请求可能已经换上了新池
+            if app.extensions['sharp_pool'] is pool:
+                logger.warning('重建进程池已损坏，重新创建')
+                pool.shutdown(wait=False)
+                app.extensions['sharp_pool'] = ProcessPoolExecutor(max_workers=Config.SHARP_POOL_WORKERS)
+            pool = app.extensions['sharp_pool']
+        return pool.submit(fn, *args)
+
+
+def _on_sharp_task_done(task_id, fut):
+    """worker进程异常退出时标记任务失败"""
+    exc = fut.exception()
+    if exc is not None:
+        logger.error('重建任务异常: %s', exc)
+        update_task_status(task_id, TaskStatus.FAILED, f"重建失败: {exc}", 0)
+
+
 def _run_sharp_task(task_id, data_dir,image_path, username, rel_folder):
     
     """后台处理任务"""
@@ -143,14 +175,18 @@ def _run_sharp_task(task_id, data_dir,image_path, username, rel_folder):
     out_dir = training_result.get('output_dir')
 
     # 查找输出目录中的 ply / ply.gz / splat 文件
-    result_file = None
+    # 一次 iterdir，扩展名不区分大小写，.ply 优先于 .splat
+    found = {}
     try:
-        for fname in os.listdir(out_dir):
-            if fname.lower().endswith(('.ply', '.splat')):
-                result_file = fname
-                break
-    except Exception:
-        result_file = None
+        for p in Path(out_dir).iterdir():
+            suffix = p.suffix.lower()
+            if suffix in ('.ply', '.splat') and suffix not in found:
+                found[suffix] = p.name
+                if suffix == '.ply':
+                    break
+    except OSError:
+        logger.exception('读取输出目录失败')
+    result_file = found.get('.ply') or found.get('.splat')
 
     if result_file:
         # 1) attempt conversion using convert.py (if available)
@@ -175,7 +211,7 @@ def _run_sharp_task(task_id, data_dir,image_path, username, rel_folder):
             try:
                 os.remove(teaser_full)
             except Exception:
-                current_app.logger.exception('删除中间文件失败')
+                logger.exception('删除中间文件失败')
             
             # 尝试将转换后的文件重命名为与输出文件夹同名（保留扩展名），避免覆盖已有文件
             try:
@@ -193,22 +229,28 @@ def _run_sharp_task(task_id, data_dir,image_path, username, rel_folder):
                     converted_name = new_name
                     converted_full = new_full
             except Exception:
-                current_app.logger.exception('重命名转换文件失败')
+                logger.exception('重命名转换文件失败')
 
             # register converted file (use final converted_name)
             rel_converted = os.path.join(rel_folder, converted_name).replace('\\', '/')
             try:
                 sm.add_model(username, rel_converted)
             except Exception:
-                current_app.logger.exception('注册转换后模型失败')
+                logger.exception('注册转换后模型失败')
 
             # prefer returning converted file as task result
             update_task_status(task_id, TaskStatus.COMPLETED, "已完成，查看模型请点击\"查看我的模型\"按钮", 100, result=rel_converted)
+
+            # 预压缩副本，供 serve_model 按 Accept-Encoding 直接下发
+            try:
+                _write_gzip_sibling(converted_full)
+            except Exception:
+                logger.exception('生成压缩副本失败')
             
             
         except Exception as e:
             # conversion failed; still register original result and finish
-            current_app.logger.exception('PLY 转换失败')
+            logger.exception('PLY 转换失败')
             rel = os.path.join(rel_folder, result_file).replace('\\', '/')
             update_task_status(task_id, TaskStatus.COMPLETED, f"完成（转换失败: {e}", 100, result=rel)
     else:
@@ -216,10 +258,19 @@ def _run_sharp_task(task_id, data_dir,image_path, username, rel_folder):
         update_task_status(task_id, TaskStatus.COMPLETED, "完成（未找到明确的模型文件，输出在目录）", 100, result=os.path.basename(out_dir))
 
 
+def _write_gzip_sibling(path):
+    """写出 <path>.gz（先写临时文件再替换，避免下发半成品）"""
+    gz_path = path + '.gz'
+    tmp_path = gz_path + '.tmp'
+    with open(path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=1) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, gz_path)
+
+
 @sharp_bp.route('/sharp/status/<task_id>')
 @login_required
 def sharp_status(task_id):
-    task = sharp_tasks.get(task_id)
+    task = task_store.get(task_id)
     if not task:
         return jsonify({'success': False, 'message': '任务不存在'}), 404
 
@@ -229,3 +280,46 @@ def sharp_status(task_id):
         'message': task.get('message', ''),
         'result': task.get('result')
     }})
+
+
+@sharp_bp.route('/sharp/stream/<task_id>')
+@login_required
+def sharp_stream(task_id):
+    """以 Server-Sent Events 推送任务状态变化，直到任务结束、连接超过
+    SSE_MAX_LIFETIME 或任务长时间无更新（前端随后改为轮询）"""
+    if task_store.get(task_id) is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+
+    def gen():
+        # 状态由进程池 worker 写入 SQLite，这里在服务端检查变化后再推送，
+        # 客户端不必周期性发起请求
+        last_updated = None
+        idle = 0.0
+        deadline = time.monotonic() + SSE_MAX_LIFETIME
+        while time.monotonic() < deadline:
+            task = task_store.get(task_id)
+            if task is None:
+                return
+            if task['updated_at'] != last_updated:
+                last_updated = task['updated_at']
+                idle = 0.0
+                item = {
+                    'status': task.get('status'),
+                    'progress': task.get('progress', 0),
+                    'message': task.get('message', ''),
+                    'result': task.get('result')
+                }
+                yield f"data: {json.dumps(item)}\n\n"
+                if item['status'] in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                    return
+            elif time.time() - task['updated_at'] > SSE_STALE_AFTER:
+                return
+            elif idle >= 15:
+                # 保活注释，防止代理断开空闲连接
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            time.sleep(SSE_POLL_INTERVAL)
+            idle += SSE_POLL_INTERVAL
+
+    return Response(gen(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -1,15 +1,15 @@
-from flask import Blueprint, render_template, jsonify, send_from_directory, send_file, current_app, session
+from flask import Blueprint, render_template, jsonify, send_from_directory, send_file, current_app, session, Response, request
 import os
+import mimetypes
+from urllib.parse import quote
 from . import login_required
-from utils.storage import StorageManager
 
 # 创建查看器蓝图
 viewer_bp = Blueprint('viewer', __name__)
 
 
 def get_user_model_dir(username):
-    data_dir = current_app.config.get('DATA_DIR', 'data')
-    sm = StorageManager(data_dir)
+    sm = current_app.extensions['storage']
     return sm.ensure_user(username)
 
 
@@ -21,8 +21,7 @@ def serve_model(filename):
     
     username = session.get('username', 'demo_user')
     
-    data_dir = current_app.config.get('DATA_DIR', 'data')
-    sm = StorageManager(data_dir)
+    sm = current_app.extensions['storage']
     models_dir = sm.ensure_user(username)
 
     try:
@@ -35,9 +34,43 @@ def serve_model(filename):
             return jsonify({'success': False, 'message': '非法的文件路径'}), 400
 
         if os.path.isfile(user_file_path):
-            # 返回文件内容（send_file 会处理 mime-type）
             current_app.logger.info(f"Serving model file: {user_file_path}")
-            return send_file(user_file_path)
+            accel_prefix = current_app.config.get('X_ACCEL_REDIRECT_PREFIX')
+            if accel_prefix:
+                # 交给nginx internal location 发送文件
+                data_dir = os.path.abspath(current_app.config.get('DATA_DIR', 'data'))
+                rel = os.path.relpath(user_file_path, data_dir).replace('\\', '/')
+                mimetype = mimetypes.guess_type(user_file_path)[0] or 'application/octet-stream'
+                return Response(status=200, headers={
+                    # 用户名/文件名可含非 ASCII 字符，头部只能是 latin-1，按 nginx 要求百分号编码
+                    'X-Accel-Redirect': accel_prefix.rstrip('/') + '/' + quote(rel),
+                    'Content-Type': mimetype,
+                })
+            # 返回文件内容（use_x_sendfile 时由前端服务器发送）
+            mimetype = mimetypes.guess_type(user_file_path)[0] or 'application/octet-stream'
+            send_path = user_file_path
+            gz_path = user_file_path + '.gz'
+            # Range 请求（如只取文件头）针对原始字节，不走压缩副本
+            use_gzip = ('Range' not in request.headers
+                        and request.accept_encodings['gzip'] > 0
+                        and os.path.isfile(gz_path))
+            if use_gzip:
+                send_path = gz_path
+            # 模型文件生成后不再变化，带上 ETag/Last-Modified 以便浏览器 304 复用缓存；
+            # 只 stat 一次，命中 If-None-Match 时不再打开文件
+            _size, mtime, etag = sm.stat_and_etag(username, filename + '.gz' if use_gzip else filename)
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+                resp.set_etag(etag)
+            else:
+                resp = send_file(send_path, mimetype=mimetype, conditional=True,
+                                 etag=etag, last_modified=mtime)
+            if use_gzip:
+                resp.headers['Content-Encoding'] = 'gzip'
+            resp.headers['Vary'] = 'Accept-Encoding'
+            # conditional=True 已支持 Range，显式告知客户端可分段获取
+            resp.headers['Accept-Ranges'] = 'bytes'
+            return resp
         else:
             return jsonify({'success': False, 'message': '模型文件不存在'}), 404
     except Exception as e:
@@ -55,8 +88,7 @@ def serve_model(filename):
 @login_required
 def list_models():
     username = session.get('username', 'demo_user')
-    data_dir = current_app.config.get('DATA_DIR', 'data')
-    sm = StorageManager(data_dir)
+    sm = current_app.extensions['storage']
     try:
         models = sm.list_models(username)
         return jsonify({'success': True, 'models': [m['relpath'] for m in models]})
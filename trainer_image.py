@@ -1,3 +1,5 @@
+import functools
+import io
 import subprocess
 import sys
 import json
@@ -5,12 +7,153 @@ from pathlib import Path
 import logging
 import time
 import os
+import signal
+import threading
+from collections import deque
 
 # 导入你的Config配置（确保Config里包含修正后的conda和环境配置）
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# 常驻 worker 每个任务结束时输出的标记行，后接 JSON {"code": 返回码}
+_JOB_DONE_MARKER = "__SHARP_JOB_DONE__"
+
+# 在虚拟环境的 python 中运行：只加载一次 sharp 命令行入口（及其 torch 等依赖），
+# 之后从 stdin 逐行读取 JSON 任务 {"in": ..., "out": ...} 并以 `sharp predict` 的参数执行
+_WORKER_SCRIPT = r"""
+import json, sys, traceback
+from importlib.metadata import entry_points
+eps = entry_points()
+eps = eps.select(group="console_scripts") if hasattr(eps, "select") else eps.get("console_scripts", [])
+main = next(ep for ep in eps if ep.name == "sharp").load()
+for line in sys.stdin:
+    job = json.loads(line)
+    sys.argv = ["sharp", "predict", "-i", job["in"], "-o", job["out"]]
+    try:
+        main()
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    # 先换行：任务最后一行输出可能没有换行符，标记必须独占一行
+    sys.stdout.write("\n%s %s\n" % ("__MARKER__", json.dumps({"code": code})))
+    sys.stdout.flush()
+""".replace("__MARKER__", _JOB_DONE_MARKER)
+
+
+class SharpWorker:
+    """常驻的 sharp 进程，摊销每次重建的解释器启动与 torch 导入开销"""
+
+    def __init__(self, python_exe, cwd, env, timeout=None):
+        self.python_exe = python_exe
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.process = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self.process is None or self.process.poll() is not None:
+            logger.info(f"启动常驻 sharp worker: {self.python_exe}")
+            self.process = subprocess.Popen(
+                [self.python_exe, "-u", "-c", _WORKER_SCRIPT],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=io.DEFAULT_BUFFER_SIZE,
+                cwd=self.cwd,
+                env=self.env,
+            )
+
+    def run(self, input_dir, output_dir, on_line):
+        """提交一个任务，输出逐行交给 on_line，返回任务返回码。
+        超过 timeout 秒未结束时杀掉 worker（读取随即遇到EOF）并抛出 RuntimeError。
+        """
+        with self._lock:
+            self._ensure_started()
+            process = self.process
+            timed_out = threading.Event()
+
+            def _kill():
+                timed_out.set()
+                process.kill()
+
+            watchdog = threading.Timer(self.timeout, _kill) if self.timeout else None
+            if watchdog is not None:
+                watchdog.daemon = True
+                watchdog.start()
+            try:
+                process.stdin.write(json.dumps({"in": str(input_dir), "out": str(output_dir)}) + "\n")
+                process.stdin.flush()
+                for line in process.stdout:
+                    if line.startswith(_JOB_DONE_MARKER):
+                        return int(json.loads(line[len(_JOB_DONE_MARKER):])["code"])
+                    on_line(line)
+            except BaseException:
+                # 任务输出未读完，worker 状态未知，丢弃
+                process.kill()
+                process.wait()
+                self.process = None
+                raise
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+            # EOF：worker 退出（崩溃或超时被杀），下次调用时重新拉起
+            code = process.wait()
+            self.process = None
+            if timed_out.is_set():
+                raise RuntimeError(f"sharp worker 超过 {self.timeout} 秒未完成，已终止")
+            raise RuntimeError(f"sharp worker 意外退出，返回码: {code}")
+
+
+# 每个（任务池）进程一个常驻 worker
+_sharp_worker = None
+_sharp_worker_lock = threading.Lock()
+
+
+def get_sharp_worker(python_exe, cwd, env):
+    global _sharp_worker
+    with _sharp_worker_lock:
+        if _sharp_worker is None:
+            _sharp_worker = SharpWorker(python_exe, cwd, env, timeout=Config.SHARP_JOB_TIMEOUT)
+        return _sharp_worker
+
+
+def _drain_pipe(fd, on_line, chunk_size=65536):
+    """以大块 os.read 读取管道直到EOF，按行（换行或进度条使用的回车）回调 on_line"""
+    buf = b""
+    while True:
+        chunk = os.read(fd, chunk_size)
+        if not chunk:
+            break
+        buf += chunk.replace(b"\r", b"\n")
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            on_line(line.decode("utf-8", errors="replace"))
+    if buf:
+        on_line(buf.decode("utf-8", errors="replace"))
+
+
+# 子进程环境每个进程只构建一次（训练器按任务创建）；Popen 只读取该映射，可安全共享
+@functools.lru_cache(maxsize=None)
+def _child_env(env_prefix, env_name):
+    return {
+        **os.environ,
+        "PATH": f"{env_prefix}/bin:{os.environ.get('PATH', '')}",
+        "CONDA_PREFIX": env_prefix,
+        "CONDA_DEFAULT_ENV": env_name,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def _inherited_env():
+    return os.environ.copy()
+
+
 class ImageModelTrainer:
     """高斯溅射模型训练器（适配conda虚拟环境+环境变量）"""
     
@@ -19,6 +162,10 @@ class ImageModelTrainer:
         self.gs_repo_path = Config.GAUSSIAN_REPO_PATH  # 修正配置名（对应之前的GAUSSIAN_REPO_PATH）
         self.conda_base = Config.CONDA_BASE  # conda根目录 /usr/local/anaconda3
         self.gs_env = Config.GAUSSIAN_ENV  # 虚拟环境名 gaussian-splatting
+        # 直接使用虚拟环境中的可执行文件，省去每次 bash + conda activate 的启动开销
+        self.env_prefix = f"{self.conda_base}/envs/{self.gs_env}"
+        self.env_bin = f"{self.env_prefix}/bin"
+        self.child_env = _child_env(self.env_prefix, self.gs_env)
 
     def _build_conda_command(self, cmd_list):
         """构建带conda激活+环境变量的完整命令"""
@@ -33,6 +180,54 @@ class ImageModelTrainer:
         full_cmd = " && ".join([activate_cmd, cd_cmd] + [" ".join(cmd_list)])
         return full_cmd
 
+    def _run_subprocess(self, base_train_cmd, output_dir, on_line):
+        """每个任务单独启动一次 sharp 进程，返回返回码"""
+        sharp_exe = f"{self.env_bin}/sharp"
+        if os.path.exists(sharp_exe):
+            # 直接执行虚拟环境中的 sharp（无需shell）
+            train_argv = [sharp_exe] + base_train_cmd[1:]
+            logger.info(f"开始重建模型（conda环境）: {train_argv}")
+            popen_kwargs = dict(args=train_argv, shell=False, env=self.child_env)
+        else:
+            # 回退：通过 bash 激活 conda 环境后执行
+            full_train_cmd = self._build_conda_command(base_train_cmd)
+            logger.info(f"开始重建模型（conda环境）: {full_train_cmd}")
+            popen_kwargs = dict(args=full_train_cmd, shell=True, executable="/bin/bash",
+                                env=_inherited_env())
+
+        # 运行训练（字节模式、无缓冲：由读取线程直接 os.read 管道）
+        process = subprocess.Popen(
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,  # 将stderr重定向到stdout，统一捕获
+            bufsize=0,
+            cwd=self.gs_repo_path,  # 工作目录设为高斯溅射项目根目录
+            # 独立进程组：超时时连同 bash 回退路径下的 sharp 子进程一起终止
+            start_new_session=(os.name == 'posix'),
+            **popen_kwargs
+        )
+        
+        logger.info(f"启动重建，输出目录: {output_dir}")
+        
+        # 独立线程持续排空管道，避免输出较多时子进程因管道写满而阻塞
+        drain = threading.Thread(target=_drain_pipe, args=(process.stdout.fileno(), on_line), daemon=True)
+        drain.start()
+        
+        # 等待进程结束并获取返回码；超时则终止，避免卡住的任务一直占用进程池
+        try:
+            return_code = process.wait(timeout=Config.SHARP_JOB_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            process.wait()
+            drain.join()
+            process.stdout.close()
+            raise RuntimeError(f"sharp 超过 {Config.SHARP_JOB_TIMEOUT} 秒未完成，已终止")
+        drain.join()
+        process.stdout.close()
+        return return_code
+
     def train(self, input_dir, output_dir):
         """训练高斯溅射模型（适配conda环境+环境变量）"""
         try:
@@ -61,46 +256,33 @@ class ImageModelTrainer:
                 '-o', str(output_dir),
             ]
             
-            # 构建带conda激活和环境变量的完整命令
-            full_train_cmd = self._build_conda_command(base_train_cmd)
-            logger.info(f"开始重建模型（conda环境）: {full_train_cmd}")
-            
-            # 运行训练（必须用shell=True执行bash命令）
-            process = subprocess.Popen(
-                full_train_cmd,
-                shell=True,  # 关键：执行bash命令（conda激活需要）
-                executable="/bin/bash",  # 核心新增：指定bash执行
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,  # 将stderr重定向到stdout，统一捕获
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                cwd=self.gs_repo_path,  # 工作目录设为高斯溅射项目根目录
-                env=os.environ.copy()  # 继承当前环境变量
-            )
-            
             # 实时监控训练输出
-            training_log = []
+            training_log = deque(maxlen=200)  # 只保留日志尾部，长时间运行内存恒定
             start_time = time.time()
-            logger.info(f"启动重建，输出目录: {output_dir}")
-            
-            while True:
-                output = process.stdout.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    output_strip = output.strip()
-                    training_log.append(output_strip)
-                    logger.info(f"重建日志 [{time.strftime('%H:%M:%S')}]: {output_strip}")
-            
-            # 等待进程结束并获取返回码
-            return_code = process.wait()
+            log_info = logger.isEnabledFor(logging.INFO)
+
+            def on_line(output):
+                output_strip = output.strip()
+                if not output_strip:
+                    return
+                training_log.append(output_strip)
+                # 时间由日志格式中的 %(asctime)s 给出；未开启 INFO 时不格式化
+                if log_info:
+                    logger.info("重建日志: %s", output_strip)
+
+            env_python = f"{self.env_bin}/python"
+            if Config.SHARP_PERSISTENT_WORKER and os.path.exists(env_python):
+                logger.info(f"启动重建（常驻worker），输出目录: {output_dir}")
+                worker = get_sharp_worker(env_python, self.gs_repo_path, self.child_env)
+                return_code = worker.run(input_dir, output_dir, on_line)
+            else:
+                return_code = self._run_subprocess(base_train_cmd, output_dir, on_line)
             elapsed_time = time.time() - start_time
             logger.info(f"重建进程结束，返回码: {return_code}，耗时: {elapsed_time:.2f}秒")
             
             # 检查重建是否成功
             if return_code != 0:
-                error_msg = f"重建进程返回非0码: {return_code}，最后10行日志: {training_log[-10:]}"
+                error_msg = f"重建进程返回非0码: {return_code}，最后10行日志: {list(training_log)[-10:]}"
                 logger.error(error_msg)
                 raise Exception(error_msg)
             
@@ -109,7 +291,7 @@ class ImageModelTrainer:
             return {
                 'success': True,
                 'output_dir': str(output_dir.absolute()),
-                'log': training_log[-10:],  # 返回最后10行日志
+                'log': list(training_log)[-10:],  # 返回最后10行日志
                 'elapsed_time': round(elapsed_time, 2),
                 'message': '模型重建完成'
             }
@@ -120,5 +302,5 @@ class ImageModelTrainer:
             return {
                 'success': False,
                 'message': error_msg,
-                'log': training_log[-10:] if 'training_log' in locals() else []
+                'log': list(training_log)[-10:] if 'training_log' in locals() else []
             }
\ No newline at end of file
@@ -1,92 +1,402 @@
+import contextlib
+import functools
+import io
+import itertools
+import json
 import os
+import shutil
+import tempfile
+import threading
+import uuid
+from pathlib import Path
 import xml.etree.ElementTree as ET
 from werkzeug.utils import secure_filename
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# uploads below the limit are written with a single write(); larger ones go
+# through os.sendfile when possible, else a 1 MiB buffered copy (werkzeug's
+# FileStorage.save uses 16 KiB)
+UPLOAD_COPY_BUFSIZE = 1024 * 1024
+UPLOAD_SINGLE_WRITE_LIMIT = 8 * 1024 * 1024
+
+
+def _stream_remaining(stream):
+    """Bytes left in a seekable stream, or None if it cannot be measured."""
+    try:
+        pos = stream.tell()
+        end = stream.seek(0, os.SEEK_END)
+        stream.seek(pos)
+        return end - pos
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _sendfile_upload(src, dst, size):
+    """Copy size bytes from src's position with os.sendfile (in-kernel, no
+    user-space buffer). Returns the bytes sent; 0 if the stream has no real fd.
+    """
+    if not hasattr(os, 'sendfile'):
+        return 0
+    try:
+        in_fd = src.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return 0
+    offset = src.tell()
+    sent = 0
+    try:
+        while sent < size:
+            n = os.sendfile(dst.fileno(), in_fd, offset + sent, size - sent)
+            if n == 0:
+                break
+            sent += n
+    except OSError:
+        pass
+    # leave src where a buffered copy should resume
+    src.seek(offset + sent)
+    return sent
+
+
+def _write_upload(file_storage, dest_path):
+    src = file_storage.stream
+    size = _stream_remaining(src)
+    with open(dest_path, 'wb') as dst:
+        if size is not None and size < UPLOAD_SINGLE_WRITE_LIMIT:
+            dst.write(src.read())
+            return
+        # large uploads are spooled by werkzeug to a temp file with a real fd
+        if size is not None and _sendfile_upload(src, dst, size) == size:
+            return
+        shutil.copyfileobj(src, dst, UPLOAD_COPY_BUFSIZE)
+
+
+# read once at import: os.umask can only be queried by setting it, which is
+# process-wide and racy once request threads are running
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _atomic_write(path, write_fn, mode='w', encoding='utf-8'):
+    """Write a whole file via a sibling temp file + os.replace, so readers see
+    either the old or the new content, never a partial write.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                               dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, mode, encoding=None if 'b' in mode else encoding) as f:
+            write_fn(f)
+        # mkstemp creates 0600 and os.replace keeps it; use the old file's mode,
+        # or what open() would have given a new file
+        try:
+            perm = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            perm = 0o666 & ~_UMASK
+        os.chmod(tmp, perm)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path, exclusive=True):
+    """Advisory inter-process lock on a sidecar file (flock; msvcrt on Windows,
+    where every lock is exclusive).
+    """
+    with open(lock_path, 'a+b') as f:
+        fd = f.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            f.seek(0)
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _remove_trees(paths):
+    for path in paths:
+        # another process may be removing the same folder; ignore races
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@functools.lru_cache(maxsize=4096)
+def _safe(name):
+    """Memoized secure_filename; uploads and renames repeat the same names."""
+    return secure_filename(name)
+
+
+if os.sep == '/':
+    def _to_slash(path):
+        return path
+else:
+    def _to_slash(path):
+        return path.replace(os.sep, '/')
+
+
+def _entry_line(relpath, name=None):
+    entry = {'path': relpath}
+    if name:
+        entry['name'] = name
+    return json.dumps(entry, ensure_ascii=False) + '\n'
+
+
+def _tombstone_line(relpath):
+    return json.dumps({'path': relpath, 'op': 'del'}, ensure_ascii=False) + '\n'
+
+
+def _generation_line():
+    return json.dumps({'gen': uuid.uuid4().hex}) + '\n'
+
 
 class StorageManager:
     """Manage per-user storage layout under DATA_DIR.
 
     Layout:
       DATA_DIR/username/
-        models.xml            -- index of model files (relative paths)
+        models.jsonl          -- index of model files (relative paths)
         imageFolder1/
             image.jpg
             image.ply
         imageFolder2/
             ...
 
+    The index is an append-only log, one JSON object per line:
+      {"gen": "<uuid>"}                              -- first line, new per rewrite
+      {"path": "image1/image1.ply", "name": "..."}   -- add ("name" optional)
+      {"path": "image1/image1.ply", "op": "del"}     -- tombstone
+    A mutation appends a line instead of rewriting the file; the log is
+    compacted once tombstones make up more than COMPACT_RATIO of it. The
+    generation line identifies a rewritten file even when the filesystem
+    reuses its inode number, so cached state is never extended across files.
+    A legacy models.xml is migrated on first access.
+
     Methods operate on paths relative to the user's dir.
     """
 
-    INDEX_NAME = 'models.xml'
+    INDEX_NAME = 'models.jsonl'
+    LEGACY_INDEX_NAME = 'models.xml'
+    COMPACT_RATIO = 0.25
+    # folders are renamed to <TRASH_PREFIX><uuid> and removed in the background
+    TRASH_PREFIX = '.deleting_'
 
     def __init__(self, data_dir):
         self.data_dir = data_dir
+        # one instance is shared per app, so guard index read-modify-write
+        self._lock = threading.RLock()
+        # username -> replayed index state; validated against the file's
+        # inode/mtime/size so appends from other instances/processes are picked
+        # up (mtime guards against a compacted log reusing the inode number)
+        self._cache = {}
+        # username -> [depth, exclusive] of the index file lock held by this
+        # instance; flock is per open file, so nested calls must not re-lock
+        self._held = {}
+        # username -> absolute user dir (data_dir never changes)
+        self._user_dirs = {}
+        # username -> resolved user dir for path-traversal checks
+        self._resolved_user_dirs = {}
+        # users whose leftover trash folders have been swept by this instance
+        self._swept = set()
 
     def user_dir(self, username):
-        return os.path.abspath(os.path.join(self.data_dir, username))
+        ud = self._user_dirs.get(username)
+        if ud is None:
+            ud = self._user_dirs[username] = os.path.abspath(os.path.join(self.data_dir, username))
+        return ud
 
     def ensure_user(self, username):
         ud = self.user_dir(username)
         os.makedirs(ud, exist_ok=True)
+        if username not in self._swept:
+            self._swept.add(username)
+            self._sweep_trash(ud)
         # ensure index exists
         idx = os.path.join(ud, self.INDEX_NAME)
         if not os.path.exists(idx):
-            root = ET.Element('models')
-            tree = ET.ElementTree(root)
-            tree.write(idx, encoding='utf-8', xml_declaration=True)
+            with self._lock, self._index_lock(username):
+                if not os.path.exists(idx):
+                    self._migrate_legacy(username)
         return ud
 
+    def _sweep_trash(self, ud):
+        """Remove trash folders left behind when a background delete was cut
+        short (process exit, worker recycled).
+        """
+        with os.scandir(ud) as it:
+            leftovers = [e.path for e in it
+                         if e.name.startswith(self.TRASH_PREFIX) and e.is_dir(follow_symlinks=False)]
+        if leftovers:
+            threading.Thread(target=_remove_trees, args=(leftovers,), daemon=True).start()
+
     def index_path(self, username):
         return os.path.join(self.user_dir(username), self.INDEX_NAME)
 
+    @contextlib.contextmanager
+    def _index_lock(self, username, exclusive=True):
+        """Hold the user's index lock (LOCK_EX for mutations, LOCK_SH for reads).
+        Must be entered with self._lock held.
+        """
+        held = self._held.get(username)
+        if held is not None:
+            if exclusive and not held[1]:
+                raise RuntimeError('cannot upgrade a shared index lock')
+            held[0] += 1
+            try:
+                yield
+            finally:
+                held[0] -= 1
+            return
+        with _file_lock(self.index_path(username) + '.lock', exclusive):
+            self._held[username] = [1, exclusive]
+            try:
+                yield
+            finally:
+                del self._held[username]
+
+    def _has_index(self, username):
+        """True if the user has an index, migrating a legacy models.xml first."""
+        if os.path.exists(self.index_path(username)):
+            return True
+        if os.path.exists(os.path.join(self.user_dir(username), self.LEGACY_INDEX_NAME)):
+            self.ensure_user(username)
+            return True
+        return False
+
+    def _migrate_legacy(self, username):
+        """Create the JSONL index, carrying over entries from models.xml if present."""
+        legacy = os.path.join(self.user_dir(username), self.LEGACY_INDEX_NAME)
+        models = {}
+        if os.path.exists(legacy):
+            try:
+                # stream the file; only the path/name attributes are needed
+                for _event, el in ET.iterparse(legacy, events=('end',)):
+                    if el.tag == 'model':
+                        path = el.get('path')
+                        if path and path not in models:
+                            models[path] = el.get('name')
+                        el.clear()
+            except ET.ParseError:
+                models = {}
+        self._rewrite(username, models)
+
+    def _rewrite(self, username, models):
+        content = _generation_line() + ''.join(_entry_line(path, name) for path, name in models.items())
+        _atomic_write(self.index_path(username), lambda f: f.write(content))
+        self._cache.pop(username, None)
+
+    def _load_index(self, username):
+        """Return the replayed index state, reading only newly appended lines
+        when the log has grown since the last call.
+        Raises FileNotFoundError if the index does not exist.
+        """
+        idx = self.index_path(username)
+        st = os.stat(idx)
+        state = self._cache.get(username)
+        if (state is not None and state['ino'] == st.st_ino
+                and state['mtime_ns'] == st.st_mtime_ns and state['size'] == st.st_size):
+            return state
+        with open(idx, 'rb') as f:
+            gen = f.readline()
+            # appends only grow the same generation; a rewrite (possibly on a
+            # reused inode) or a shrink means a full replay
+            if (state is None or state['gen'] != gen or state['ino'] != st.st_ino
+                    or st.st_size <= state['size']):
+                state = {'gen': gen, 'ino': st.st_ino, 'size': 0, 'offset': 0,
+                         'lines': 0, 'models': {}}
+            state['mtime_ns'] = st.st_mtime_ns
+            f.seek(state['offset'])
+            data = f.read()
+        # only consume complete lines; a partially written tail is read next time
+        end = data.rfind(b'\n') + 1
+        for raw in data[:end].splitlines():
+            try:
+                entry = json.loads(raw)
+                if 'gen' in entry:
+                    continue
+                state['lines'] += 1
+                path = entry['path']
+            except (ValueError, KeyError, TypeError):
+                state['lines'] += 1
+                continue
+            if entry.get('op') == 'del':
+                state['models'].pop(path, None)
+            elif path not in state['models']:
+                state['models'][path] = entry.get('name')
+        state['offset'] += end
+        state['size'] = state['offset'] + (len(data) - end)
+        self._cache[username] = state
+        return state
+
+    def _append(self, username, lines):
+        state = self._load_index(username)
+        # a partial tail left by a crashed writer: terminate it so the new
+        # entries start on their own line (the tail itself fails to parse)
+        lead = '\n' if state['size'] > state['offset'] else ''
+        # O_APPEND: each write lands at the current end of file
+        with open(self.index_path(username), 'a', encoding='utf-8') as f:
+            f.write(lead + ''.join(lines))
+        return self._load_index(username)
+
+    def _maybe_compact(self, username, state):
+        dead = state['lines'] - len(state['models'])
+        if dead > self.COMPACT_RATIO * state['lines']:
+            self._rewrite(username, dict(state['models']))
+
     def list_models(self, username):
         """Return list of model entries: dicts with 'relpath' and 'name'"""
-        idx = self.index_path(username)
-        models = []
-        if not os.path.exists(idx):
-            return models
-        try:
-            tree = ET.parse(idx)
-            root = tree.getroot()
-            for m in root.findall('model'):
-                path = m.get('path')
-                name = m.get('name') or os.path.basename(path)
-                models.append({'relpath': path, 'name': name})
-        except ET.ParseError:
-            return []
-        return models
+        with self._lock:
+            if not self._has_index(username):
+                return []
+            with self._index_lock(username, exclusive=False):
+                models = self._load_index(username)['models']
+                return [{'relpath': path, 'name': name or os.path.basename(path)}
+                        for path, name in models.items()]
 
     def add_model(self, username, relpath, display_name=None):
         """Add a model entry (relpath is like image1/image1.ply)"""
-        ud = self.ensure_user(username)
-        idx = self.index_path(username)
-        tree = ET.parse(idx)
-        root = tree.getroot()
-        # avoid duplicates
-        for m in root.findall('model'):
-            if m.get('path') == relpath:
-                return
-        el = ET.SubElement(root, 'model')
-        el.set('path', relpath)
-        if display_name:
-            el.set('name', display_name)
-        tree.write(idx, encoding='utf-8', xml_declaration=True)
+        with self._lock:
+            ud = self.ensure_user(username)
+            with self._index_lock(username):
+                # avoid duplicates
+                if relpath in self._load_index(username)['models']:
+                    return
+                self._append(username, [_entry_line(relpath, display_name)])
 
     def remove_model(self, username, relpath):
-        idx = self.index_path(username)
-        if not os.path.exists(idx):
-            return False
-        tree = ET.parse(idx)
-        root = tree.getroot()
-        removed = False
-        for m in root.findall('model'):
-            if m.get('path') == relpath:
-                root.remove(m)
-                removed = True
-        if removed:
-            tree.write(idx, encoding='utf-8', xml_declaration=True)
-        return removed
+        # direct lookup in the path-keyed index, no scan
+        return self._remove(username, lambda models: [relpath] if relpath in models else []) > 0
+
+    def remove_models_under(self, username, prefix):
+        """Remove every entry whose relpath starts with prefix (e.g. 'image1/').
+        Appends all tombstones in one write. Returns the number removed.
+        """
+        return self._remove(username, lambda models: [p for p in models if p.startswith(prefix)])
+
+    def _remove(self, username, select):
+        """select(models) returns the relpaths to drop from the path->name index."""
+        with self._lock:
+            if not self._has_index(username):
+                return 0
+            with self._index_lock(username):
+                doomed = select(self._load_index(username)['models'])
+                if doomed:
+                    state = self._append(username, [_tombstone_line(path) for path in doomed])
+                    self._maybe_compact(username, state)
+                return len(doomed)
 
     def rename_model(self, username, old_relpath, new_base_name):
         """Rename a model file (only change base name, keep extension and folder).
@@ -95,6 +405,9 @@ class StorageManager:
         """
         ud = self.user_dir(username)
         old_full = os.path.abspath(os.path.join(ud, old_relpath))
+        self._check_inside_user_dir(username, old_full)
+        # the check above resolves symlinks; the index relpath is sliced from
+        # the unresolved path below, so it must also be lexically under ud
         if not old_full.startswith(ud + os.sep):
             raise ValueError('非法路径')
         if not os.path.exists(old_full):
@@ -110,16 +423,22 @@ class StorageManager:
         else:
             base_old, ext = os.path.splitext(old_name)
 
-        new_name = secure_filename(new_base_name) + ext
+        new_name = _safe(new_base_name) + ext
         new_full = os.path.join(folder, new_name)
         if os.path.exists(new_full):
             raise FileExistsError('目标已存在')
-        os.rename(old_full, new_full)
-        # update index
-        old_rel = os.path.relpath(old_full, ud).replace('\\', '/')
-        new_rel = os.path.relpath(new_full, ud).replace('\\', '/')
-        self.remove_model(username, old_rel)
-        self.add_model(username, new_rel)
+        # update index; old_full starts with ud + os.sep, so slice the prefix
+        # off instead of os.path.relpath
+        rel_dir = _to_slash(folder[len(ud) + 1:])
+        old_rel = f"{rel_dir}/{old_name}" if rel_dir else old_name
+        new_rel = f"{rel_dir}/{new_name}" if rel_dir else new_name
+        with self._lock, self._index_lock(username):
+            os.rename(old_full, new_full)
+            # keep a precompressed sibling (model.ply.gz) in step with the model
+            if os.path.exists(old_full + '.gz'):
+                os.replace(old_full + '.gz', new_full + '.gz')
+            self.remove_model(username, old_rel)
+            self.add_model(username, new_rel)
         return new_rel
 
     def save_image(self, username, file_storage):
@@ -127,24 +446,49 @@ class StorageManager:
         Returns (folder_relpath, image_filename, image_fullpath)
         """
         ud = self.ensure_user(username)
-        orig = secure_filename(file_storage.filename)
+        orig = _safe(file_storage.filename)
         base = os.path.splitext(orig)[0]
         # create unique folder name
-        folder_name = secure_filename(base)
-        folder = os.path.join(ud, folder_name)
-        i = 1
-        while os.path.exists(folder):
-            folder = os.path.join(ud, f"{folder_name}_{i}")
-            i += 1
-        os.makedirs(folder, exist_ok=True)
+        folder_name = _safe(base)
+        # one directory read instead of a stat per taken suffix; mkdir (not
+        # exist_ok) so a concurrent upload can't claim the same folder
+        with os.scandir(ud) as it:
+            existing = {e.name for e in it}
+        candidates = itertools.chain([folder_name], (f"{folder_name}_{i}" for i in itertools.count(1)))
+        for name in candidates:
+            if name in existing:
+                continue
+            folder = os.path.join(ud, name)
+            try:
+                os.mkdir(folder)
+                break
+            except FileExistsError:
+                continue
         image_path = os.path.join(folder, orig)
-        file_storage.save(image_path)
-        rel_folder = os.path.relpath(folder, ud).replace('\\', '/')
-        return rel_folder, orig, image_path
+        _write_upload(file_storage, image_path)
+        # folder is ud/<name>, so the relative path is just the folder name
+        return name, orig, image_path
 
     def get_full_path(self, username, relpath):
         ud = self.user_dir(username)
         full = os.path.abspath(os.path.join(ud, relpath))
-        if not full.startswith(ud + os.sep):
-            raise ValueError('非法路径')
+        self._check_inside_user_dir(username, full)
         return full
+
+    def stat_and_etag(self, username, relpath):
+        """Return (size, mtime, etag) for a model file from a single stat.
+        The etag covers inode and mtime_ns, so a file re-created at the same
+        path (by this or another worker process) gets a new one.
+        Raises ValueError for paths outside the user dir, FileNotFoundError if missing.
+        """
+        st = os.stat(self.get_full_path(username, relpath))
+        return st.st_size, int(st.st_mtime), f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    def _check_inside_user_dir(self, username, full):
+        """Raise ValueError unless full resolves to a path strictly inside the user's dir."""
+        root = self._resolved_user_dirs.get(username)
+        if root is None:
+            root = self._resolved_user_dirs[username] = Path(self.user_dir(username)).resolve()
+        resolved = Path(full).resolve()
+        if resolved == root or not resolved.is_relative_to(root):
+            raise ValueError('非法路径')
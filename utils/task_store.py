@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import time
+
+
+class TaskStore:
+    """Persist sharp task status in a small SQLite database.
+
+    The worker processes and the Flask process each open their own
+    connection to the same file, so task state is shared across processes
+    and survives a server restart. `progress` and `result` are stored as
+    JSON so any value the task reports round-trips unchanged.
+
+    Each row records the pid of the server process that created it
+    (`owner_pid`). Pool workers die with that process, so a non-terminal
+    task whose owner is gone will never finish; `fail_orphaned` marks such
+    rows failed at startup.
+    """
+
+    TERMINAL = ('completed', 'failed')
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tasks ('
+                ' task_id TEXT PRIMARY KEY,'
+                ' status TEXT,'
+                ' progress TEXT,'
+                ' message TEXT,'
+                ' result TEXT,'
+                ' created_at REAL,'
+                ' updated_at REAL,'
+                ' owner_pid INTEGER)'
+            )
+            try:
+                conn.execute('ALTER TABLE tasks ADD COLUMN owner_pid INTEGER')
+            except sqlite3.OperationalError:
+                pass  # column already present
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def update(self, task_id, status, message="", progress=0, result=None):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT INTO tasks (task_id, status, progress, message, result, created_at, updated_at, owner_pid)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+                    ' ON CONFLICT(task_id) DO UPDATE SET'
+                    ' status=excluded.status, progress=excluded.progress, message=excluded.message,'
+                    ' result=excluded.result, updated_at=excluded.updated_at',
+                    (task_id, status, json.dumps(progress), message, json.dumps(result), now, now,
+                     os.getpid()),
+                )
+        finally:
+            conn.close()
+
+    def fail_orphaned(self, message):
+        """Mark non-terminal tasks whose owning process is gone as failed.
+        Call at startup, before this process creates tasks: rows already
+        owned by our own pid come from an earlier run that had the same pid
+        (e.g. PID 1 in a container) and are failed too.
+        Returns the number of rows updated.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT task_id, owner_pid FROM tasks WHERE status NOT IN (?, ?)',
+                self.TERMINAL,
+            ).fetchall()
+            dead = [task_id for task_id, pid in rows if not _pid_alive(pid)]
+            if dead:
+                now = time.time()
+                with conn:
+                    conn.executemany(
+                        'UPDATE tasks SET status = ?, message = ?, updated_at = ?'
+                        ' WHERE task_id = ? AND status NOT IN (?, ?)',
+                        [('failed', message, now, task_id) + self.TERMINAL for task_id in dead],
+                    )
+        finally:
+            conn.close()
+        return len(dead)
+
+    def get(self, task_id):
+        """Return the task dict or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT status, progress, message, result, created_at, updated_at'
+                ' FROM tasks WHERE task_id = ?',
+                (task_id,),
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        status, progress, message, result, created_at, updated_at = row
+        return {
+            "status": status,
+            "message": message,
+            "progress": json.loads(progress) if progress is not None else 0,
+            "result": json.loads(result) if result is not None else None,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+
+def _pid_alive(pid):
+    if not pid or pid == os.getpid():
+        # row written before owner_pid was recorded, or by a previous run
+        # with our pid
+        return False
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows; keep the row
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
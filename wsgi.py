@@ -0,0 +1,15 @@
+"""生产环境 WSGI 入口
+
+示例：
+    WEB_CONCURRENCY=4 gunicorn -k gthread --threads 8 -b 0.0.0.0:8090 wsgi:app
+
+每个 worker 都会调用 create_app 并创建自己的重建进程池。worker 数通过
+WEB_CONCURRENCY 指定（gunicorn 以它作为 -w 的默认值），Config 据此把
+SHARP_MAX_WORKERS 平分给各 worker，整个服务同时运行的重建任务不超过该上限。
+不要再单独传 -w，否则两处 worker 数不一致。
+
+开发调试仍可使用 `python main.py`（SHARP_DEBUG=1 开启调试模式）。
+"""
+from main import create_app
+
+app = create_app()